@@ -13,70 +13,399 @@ Tools:
   - get_green_metrics        — local CPU/RAM carbon audit
   - get_azure_carbon_estimate — live Azure cloud spend → carbon estimate
   - audit_code               — green code review powered by fine-tuned model
+  - audit_code_batch         — reviews several snippets in a single model call
 """
 
 import asyncio
+import contextlib
+import hashlib
+import logging
 import os
+import random
+import re
+import sys
+import textwrap
+import time
 import psutil
+from collections import OrderedDict
+from collections.abc import AsyncIterator
 from datetime import datetime, timezone
 from typing import Annotated
 
 from dotenv import load_dotenv
 from openai import AsyncAzureOpenAI
 from semantic_kernel import Kernel
-from semantic_kernel.agents import ChatCompletionAgent
-from semantic_kernel.connectors.ai.open_ai import AzureChatCompletion
 from semantic_kernel.functions import kernel_function
 
+# Make the shared greensentry package importable when run as a script
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from greensentry.constants import (
+    AZURE_KG_CO2_PER_KWH,
+    AZURE_USD_PER_KWH,
+    IDLE_WATTS,
+    LOCAL_CO2_G_PER_WATT,
+    WATTS_PER_CPU_PERCENT,
+)
+from greensentry.examples import raw_data
+
+
 # =============================================================================
 # Few-shot examples for the code auditor
 # =============================================================================
-# These are the same examples used to fine-tune the model.
+# These are the same examples used to fine-tune the model (greensentry/examples.py),
+# plus a few extra ones that only appear in the prompt.
 # When the fine-tuned deployment isn't available yet, this system prompt
 # teaches the base model to respond in exactly the same REFACTOR/WHY format.
 # Think of it like handing an intern a cheat sheet before their first shift.
+#
+# The prompt is deliberately kept above 1024 tokens: Azure OpenAI caches any
+# identical prefix of that size, so every audit after the first reuses the
+# cached system prompt (cheaper input tokens, faster first token).
+
+_AUDITOR_EXAMPLES = raw_data + [
+    {
+        "hungry": "report = ''\nfor row in rows:\n    report += format_row(row) + '\\n'",
+        "green": "report = '\\n'.join(format_row(row) for row in rows)",
+        "explanation": "Joining once avoids re-copying the growing string on every iteration, cutting CPU and memory churn."
+    },
+    {
+        "hungry": "for user_id in user_ids:\n    with open('config.json') as f:\n        config = json.load(f)\n    notify(user_id, config)",
+        "green": "with open('config.json') as f:\n    config = json.load(f)\nfor user_id in user_ids:\n    notify(user_id, config)",
+        "explanation": "Reading the file once outside the loop removes repeated disk I/O and JSON parsing."
+    },
+    {
+        "hungry": "import requests\nresults = []\nfor url in urls:\n    results.append(requests.get(url).json())",
+        "green": "import asyncio, aiohttp\n\nasync def fetch(session, url):\n    async with session.get(url) as resp:\n        return await resp.json()\n\nasync def fetch_all(urls):\n    async with aiohttp.ClientSession() as session:\n        return await asyncio.gather(*(fetch(session, u) for u in urls))\n\nresults = asyncio.run(fetch_all(urls))",
+        "explanation": "Concurrent async requests finish in the time of the slowest call instead of the sum, so the machine idles far less while waiting on the network."
+    },
+    {
+        "hungry": "for order_id in order_ids:\n    cursor.execute('SELECT * FROM orders WHERE id = ?', (order_id,))\n    orders.append(cursor.fetchone())",
+        "green": "placeholders = ','.join('?' * len(order_ids))\ncursor.execute(f'SELECT id, total FROM orders WHERE id IN ({placeholders})', order_ids)\norders = cursor.fetchall()",
+        "explanation": "One batched query replaces N round trips (the N+1 problem), saving database CPU and network energy."
+    },
+    {
+        "hungry": "import re\nfor line in log_lines:\n    if re.match(r'^ERROR \\[(\\w+)\\]', line):\n        handle(line)",
+        "green": "import re\nERROR_RE = re.compile(r'^ERROR \\[(\\w+)\\]')\nfor line in log_lines:\n    if ERROR_RE.match(line):\n        handle(line)",
+        "explanation": "Compiling the pattern once skips a regex cache lookup and parse on every line of a hot loop."
+    },
+    {
+        "hungry": "blocked = ['10.0.0.1', '10.0.0.2', '10.0.0.3']  # thousands of entries\nfor request in requests_seen:\n    if request.ip in blocked:\n        reject(request)",
+        "green": "blocked = {'10.0.0.1', '10.0.0.2', '10.0.0.3'}  # thousands of entries\nfor request in requests_seen:\n    if request.ip in blocked:\n        reject(request)",
+        "explanation": "Set membership is O(1) instead of scanning the whole list for every request, removing wasted CPU cycles."
+    },
+    {
+        "hungry": "import time\nwhile not job.is_done():\n    time.sleep(0.01)",
+        "green": "import time\ndelay = 1\nwhile not job.is_done():\n    time.sleep(delay)\n    delay = min(delay * 2, 60)",
+        "explanation": "Exponential backoff lets the CPU stay in low-power idle states instead of waking up 100 times a second."
+    },
+    {
+        "hungry": "with open('events.log') as f:\n    lines = f.readlines()\nerrors = [l for l in lines if 'ERROR' in l]\nprint(len(errors))",
+        "green": "with open('events.log') as f:\n    error_count = sum(1 for line in f if 'ERROR' in line)\nprint(error_count)",
+        "explanation": "Streaming the file line by line keeps memory flat instead of loading the whole log into RAM twice."
+    },
+    {
+        "hungry": "for image_path in image_paths:\n    model = load_model('resnet50.pt')\n    predictions.append(model.predict(load_image(image_path)))",
+        "green": "model = load_model('resnet50.pt')\nbatch = [load_image(p) for p in image_paths]\npredictions = model.predict_batch(batch)",
+        "explanation": "Loading the model once and predicting in a batch avoids repeated disk reads and keeps the accelerator fully utilised."
+    },
+]
+
+_AUDITOR_SYSTEM_PROMPT = (
+    "You are a Green Software SRE. Identify carbon-heavy code and provide a green refactor.\n"
+    "\n"
+    "Always respond in this exact format:\n"
+    "REFACTOR: <the improved code>\n"
+    "WHY: <one sentence explaining the energy/carbon saving>\n"
+    "\n"
+    "Examples:\n"
+    "---\n"
+    + "\n---\n".join(
+        f"User: Audit this code for energy efficiency: {e['hungry']}\n"
+        f"REFACTOR: {e['green']}\n"
+        f"WHY: {e['explanation']}"
+        for e in _AUDITOR_EXAMPLES
+    )
+    + "\n"
+)
 
-_AUDITOR_SYSTEM_PROMPT = """You are a Green Software SRE. Identify carbon-heavy code and provide a green refactor.
-
-Always respond in this exact format:
-REFACTOR: <the improved code>
-WHY: <one sentence explaining the energy/carbon saving>
-
-Examples:
----
-User: Audit this code for energy efficiency: while True: print('Checking updates...')
-REFACTOR: import time
-while True:
-    print('Checking updates...')
-    time.sleep(60)
-WHY: Adding a sleep timer prevents 100% CPU usage during idle loops.
----
-User: Audit this code for energy efficiency: data = [i for i in range(1000000)]
-for x in data: print(x)
-REFACTOR: for x in range(1000000): print(x)
-WHY: Using a generator/range instead of a full list saves significant RAM.
----
-User: Audit this code for energy efficiency: import pandas as pd
-df = pd.read_csv('huge_file.csv')
-REFACTOR: import pandas as pd
-for chunk in pd.read_csv('huge_file.csv', chunksize=1000): process(chunk)
-WHY: Processing data in chunks prevents memory spikes and disk swapping.
----
-User: Audit this code for energy efficiency: cursor.execute('SELECT * FROM global_users')
-REFACTOR: cursor.execute('SELECT username FROM global_users WHERE user_id = ?', (uid,))
-WHY: Selecting only necessary columns reduces data transfer energy (Network Carbon).
----
-User: Audit this code for energy efficiency: for x in big_list:
-    result = heavy_computation(x)
-    process(result)
-REFACTOR: import functools
-@functools.lru_cache(maxsize=128)
-def cached_heavy(x): return heavy_computation(x)
-
-for x in big_list:
-    process(cached_heavy(x))
-WHY: Caching/Memoization prevents the CPU from repeating expensive calculations.
-"""
+# A stable end-user id keeps every audit routed to the same prompt cache
+_AUDITOR_CACHE_USER = "greensentry-auditor-v1"
+
+# Snippets that are copies of a known example get the example's answer
+# locally — zero latency, zero tokens. Only whitespace is normalised: any other
+# difference (a table name, a file name, a constant) may change the right
+# refactor, so those snippets still go to the model.
+
+
+def _normalize_snippet(code: str) -> str:
+    return " ".join(textwrap.dedent(code).split())
+
+
+_EXAMPLE_INDEX = {
+    _normalize_snippet(e["hungry"]): f"REFACTOR: {e['green']}\nWHY: {e['explanation']}"
+    for e in _AUDITOR_EXAMPLES
+}
+
+
+def _match_known_example(code: str) -> str | None:
+    """Returns the canned audit for a snippet identical to a known example, else None."""
+    return _EXAMPLE_INDEX.get(_normalize_snippet(code))
+
+
+# =============================================================================
+# Report templates
+# =============================================================================
+# Tool reports are filled from these module-level templates; binding
+# format_map once keeps the per-call work to a single formatting pass.
+
+_LOCAL_REPORT = (
+    "Local Hardware Audit:\n"
+    "- CPU Usage: {cpu}%\n"
+    "- RAM Usage: {ram}%\n"
+    "- Estimated Power Draw: {watts:.2f}W\n"
+    "- Carbon Footprint: {carbon:.5f}g CO2/hr"
+).format_map
+
+_AZURE_REPORT = (
+    "Azure Cloud Audit ({period}):\n"
+    "- Total Spend: ${cost:.4f} {currency}\n"
+    "- Estimated Energy: {kwh:.4f} kWh\n"
+    "- Carbon Footprint: {carbon:.6f} kg CO2\n"
+    "- Source: Azure Cost Management API (live data)"
+).format_map
+
+_AZURE_EMPTY_REPORT = (
+    "Azure Cloud Audit ({period}):\n"
+    "- Total Spend: $0.00 (no billable usage this month)\n"
+    "- Carbon Footprint: 0.000000 kg CO2\n"
+    "- Source: Azure Cost Management API (live data)"
+).format_map
+
+
+# =============================================================================
+# Azure result cache
+# =============================================================================
+# The Cost Management API is slow (seconds) and throttles repeat queries, while
+# follow-up questions in a chat usually ask about the same billing period.
+# Reports are kept per (subscription, billing period) for a few minutes.
+
+_AZURE_CACHE_TTL_SECONDS = 300
+_azure_cache: dict[tuple[str, str], tuple[float, str]] = {}
+
+# DefaultAzureCredential probes a chain of providers when it's built; one
+# instance is shared for the process so its token cache survives across calls.
+_credential = None
+
+
+def _get_azure_credential():
+    """Returns the shared async DefaultAzureCredential, creating it on first use."""
+    global _credential
+    if _credential is None:
+        from azure.identity.aio import DefaultAzureCredential
+        _credential = DefaultAzureCredential()
+    return _credential
+
+
+_AZURE_MANAGEMENT_SCOPE = "https://management.azure.com/.default"
+_credential_warmup_task: asyncio.Task | None = None
+
+
+async def _warm_azure_credential() -> None:
+    """Acquires a management token so the first Azure query skips the provider probe."""
+    # A failed probe (nobody logged in) is logged by azure.identity at WARNING,
+    # which would land on stderr over the "You: " prompt; mute it for the warm-up.
+    identity_logger = logging.getLogger("azure.identity")
+    previous_level = identity_logger.level
+    identity_logger.setLevel(logging.ERROR)
+    try:
+        await _get_azure_credential().get_token(_AZURE_MANAGEMENT_SCOPE)
+    except Exception:
+        pass  # Not fatal: the real query will report any auth problem to the user
+    finally:
+        identity_logger.setLevel(previous_level)
+
+
+async def _wait_for_credential_warmup() -> None:
+    """Lets a pending warm-up finish so a query doesn't start a second provider probe."""
+    if _credential_warmup_task is not None and not _credential_warmup_task.done():
+        # shield: cancelling the tool call shouldn't cancel the shared warm-up
+        await asyncio.shield(_credential_warmup_task)
+
+
+def start_azure_credential_warmup() -> None:
+    """Starts fetching an Azure token in the background, if Azure is configured.
+
+    Credential discovery (managed identity probe, CLI fallback) takes 1-2s; doing
+    it while the user types their first prompt keeps it off the first query.
+    """
+    global _credential_warmup_task
+    if not os.getenv("AZURE_SUBSCRIPTION_ID"):
+        return
+    try:
+        asyncio.get_running_loop()
+    except RuntimeError:
+        return  # No loop yet; the credential is built on the first Azure query
+    _credential_warmup_task = asyncio.create_task(_warm_azure_credential())
+
+
+async def close_azure_credential() -> None:
+    """Stops any pending token warm-up and closes the shared Azure credential."""
+    global _credential, _credential_warmup_task
+    if _credential_warmup_task is not None:
+        _credential_warmup_task.cancel()
+        with contextlib.suppress(asyncio.CancelledError):
+            await _credential_warmup_task
+        _credential_warmup_task = None
+    if _credential is not None:
+        await _credential.close()
+        _credential = None
+
+# Cost Management throttles bursts of queries with HTTP 429. The query is a
+# POST and the throttle hint arrives in x-ms-ratelimit-*-retry-after headers,
+# neither of which azure-core's retry policy acts on, so 429s are retried here
+# with exponential backoff (1s, 2s, 4s, 8s + jitter, capped at 32s).
+_AZURE_MAX_ATTEMPTS = 5
+_AZURE_BACKOFF_BASE_SECONDS = 1.0
+_AZURE_BACKOFF_MAX_SECONDS = 32.0
+
+
+def _retry_after_seconds(error) -> float:
+    """Reads the longest retry-after hint (standard or x-ms-ratelimit-*) from a response."""
+    response = getattr(error, "response", None)
+    headers = getattr(response, "headers", None) or {}
+    hints = []
+    for name, value in headers.items():
+        if name.lower().endswith("retry-after"):
+            try:
+                hints.append(float(value))
+            except (TypeError, ValueError):
+                pass
+    return max(hints, default=0.0)
+
+
+async def _query_cost_with_backoff(client, scope: str, query):
+    """Runs a Cost Management query, retrying throttled (429) responses with backoff."""
+    from azure.core.exceptions import HttpResponseError
+
+    for attempt in range(_AZURE_MAX_ATTEMPTS):
+        try:
+            return await client.query.usage(scope=scope, parameters=query)
+        except HttpResponseError as e:
+            if e.status_code != 429 or attempt == _AZURE_MAX_ATTEMPTS - 1:
+                raise
+            delay = min(_AZURE_BACKOFF_MAX_SECONDS, _AZURE_BACKOFF_BASE_SECONDS * 2 ** attempt)
+            delay += random.uniform(0, _AZURE_BACKOFF_BASE_SECONDS)
+            await asyncio.sleep(min(_AZURE_BACKOFF_MAX_SECONDS, max(delay, _retry_after_seconds(e))))
+
+
+# =============================================================================
+# Audit result cache
+# =============================================================================
+# Users often re-audit the same function after trivial edits. Audits are kept
+# in a small LRU keyed by deployment + a hash of the dedented snippet, so a
+# repeat audit returns instantly and costs zero tokens.
+
+_AUDIT_CACHE_MAXSIZE = 256
+_AUDIT_CACHE_TTL_SECONDS = 3600
+_audit_cache: "OrderedDict[tuple[str, bytes], tuple[float, str]]" = OrderedDict()
+
+
+def _audit_cache_key(deployment: str, code: str) -> tuple[str, bytes]:
+    """Keys a snippet by deployment and a digest of its normalised source."""
+    normalized = textwrap.dedent(code).strip().encode()
+    return deployment, hashlib.blake2b(normalized, digest_size=16).digest()
+
+
+def _get_cached_audit(key: tuple[str, bytes]) -> str | None:
+    """Returns a fresh cached audit and marks it recently used, else None."""
+    cached = _audit_cache.get(key)
+    if cached and time.monotonic() - cached[0] < _AUDIT_CACHE_TTL_SECONDS:
+        _audit_cache.move_to_end(key)
+        return cached[1]
+    return None
+
+
+def _store_audit(key: tuple[str, bytes], result: str) -> None:
+    """Caches an audit result, evicting the least recently used entry if full."""
+    _audit_cache[key] = (time.monotonic(), result)
+    _audit_cache.move_to_end(key)
+    if len(_audit_cache) > _AUDIT_CACHE_MAXSIZE:
+        _audit_cache.popitem(last=False)
+
+
+# Each batched snippet gets a 400-token answer budget; 8 per call keeps a reply
+# at 3200 tokens, well inside gpt-4o-mini's output limit. Larger pastes are
+# split into several calls that run concurrently.
+_BATCH_MAX_SNIPPETS = 8
+
+
+def _auditor_deployment() -> tuple[str, str]:
+    """Picks the auditor deployment and its display label.
+
+    Uses the fine-tuned model if available, otherwise falls back to the base model.
+    """
+    ft_deployment = os.getenv("AZURE_OPENAI_FT_DEPLOYMENT")
+    deployment = ft_deployment or os.getenv("AZURE_OPENAI_DEPLOYMENT", "gpt-4o-mini")
+    model_label = "fine-tuned auditor" if ft_deployment else "base model (fine-tuning pending)"
+    return deployment, model_label
+
+
+# =============================================================================
+# Background hardware sampler
+# =============================================================================
+# A 1s CPU sample per get_green_metrics call adds up when the user asks about
+# load repeatedly. While the agent runs, a background task samples CPU/RAM once
+# a second and the tool just reads the latest values.
+
+_SAMPLE_INTERVAL_SECONDS = 1.0
+_SAMPLE_MAX_AGE_SECONDS = 5.0
+_latest_sample: tuple[float, float, float] | None = None  # (cpu %, ram %, monotonic time)
+_sampler_task: asyncio.Task | None = None
+
+
+async def _sampler_loop() -> None:
+    """Refreshes _latest_sample every interval until cancelled."""
+    global _latest_sample
+    psutil.cpu_percent(interval=None)  # prime: the first reading is meaningless
+    while True:
+        await asyncio.sleep(_SAMPLE_INTERVAL_SECONDS)
+        _latest_sample = (
+            psutil.cpu_percent(interval=None),
+            psutil.virtual_memory().percent,
+            time.monotonic(),
+        )
+
+
+def start_metrics_sampler() -> None:
+    """Starts the background sampler on the running event loop, if not already running."""
+    global _sampler_task
+    if _sampler_task is not None and not _sampler_task.done():
+        return
+    try:
+        asyncio.get_running_loop()
+    except RuntimeError:
+        return  # No loop yet; get_green_metrics falls back to sampling on demand
+    _sampler_task = asyncio.create_task(_sampler_loop())
+
+
+async def stop_metrics_sampler() -> None:
+    """Cancels the background sampler and forgets its last reading."""
+    global _sampler_task, _latest_sample
+    if _sampler_task is not None:
+        _sampler_task.cancel()
+        with contextlib.suppress(asyncio.CancelledError):
+            await _sampler_task
+        _sampler_task = None
+    _latest_sample = None
+
+
+def create_openai_client() -> AsyncAzureOpenAI:
+    """Creates the Azure OpenAI client used by the code auditor."""
+    return AsyncAzureOpenAI(
+        azure_endpoint=os.getenv("AZURE_OPENAI_ENDPOINT"),
+        api_key=os.getenv("AZURE_OPENAI_API_KEY"),
+        api_version="2024-08-01-preview",
+    )
 
 
 # =============================================================================
@@ -89,6 +418,23 @@ WHY: Caching/Memoization prevents the CPU from repeating expensive calculations.
 class GreenSentryPlugin:
     """Carbon auditing tools available to the GreenSentry agent."""
 
+    def __init__(self, openai_client: AsyncAzureOpenAI | None = None):
+        # One client (and its connection pool) is reused across audits so each
+        # call skips a fresh TLS handshake. Built lazily when not injected.
+        self._client = openai_client
+
+    def _get_openai_client(self) -> AsyncAzureOpenAI:
+        """Returns the shared auditor client, creating it on first use."""
+        if self._client is None:
+            self._client = create_openai_client()
+        return self._client
+
+    async def aclose(self) -> None:
+        """Closes the auditor client, if one was created."""
+        if self._client is not None:
+            await self._client.close()
+            self._client = None
+
     @kernel_function(
         name="get_green_metrics",
         description="Measures the current machine's CPU and RAM usage and calculates "
@@ -96,89 +442,100 @@ class GreenSentryPlugin:
                     "of CO2 per hour. Call this when the user asks about local machine "
                     "energy use, CPU load, or carbon footprint of their computer."
     )
-    def get_green_metrics(self) -> Annotated[str, "Local hardware carbon audit report"]:
+    async def get_green_metrics(self) -> Annotated[str, "Local hardware carbon audit report"]:
         """Reads Mac CPU/RAM and estimates carbon footprint using real power profiles."""
-        cpu = psutil.cpu_percent(interval=1)
-        ram = psutil.virtual_memory().percent
-
-        # Mac power draw: 5W idle, scales with CPU load
-        # Source: https://eclecticlight.co/2024/02/23/apple-silicon-2-power-and-thermal-glory/
-        # Carbon intensity: 0.475g CO2 per Wh (average US grid)
-        est_watts = 5 + (cpu * 0.55)
-        carbon_impact = (est_watts / 1000) * 0.475
-
-        return (
-            f"Local Hardware Audit:\n"
-            f"- CPU Usage: {cpu}%\n"
-            f"- RAM Usage: {ram}%\n"
-            f"- Estimated Power Draw: {est_watts:.2f}W\n"
-            f"- Carbon Footprint: {carbon_impact:.5f}g CO2/hr"
-        )
+        sample = _latest_sample
+        if sample and time.monotonic() - sample[2] < _SAMPLE_MAX_AGE_SECONDS:
+            cpu, ram, _ = sample
+        else:
+            # No fresh background sample: prime the counter, then await the 1s
+            # window instead of letting psutil sleep on the event loop thread.
+            psutil.cpu_percent(interval=None)
+            await asyncio.sleep(1.0)
+            cpu = psutil.cpu_percent(interval=None)
+            ram = psutil.virtual_memory().percent
+
+        # Power profile and grid intensity live in greensentry/constants.py
+        est_watts = IDLE_WATTS + cpu * WATTS_PER_CPU_PERCENT
+        carbon_impact = est_watts * LOCAL_CO2_G_PER_WATT
+
+        return _LOCAL_REPORT({"cpu": cpu, "ram": ram, "watts": est_watts, "carbon": carbon_impact})
 
     @kernel_function(
         name="get_azure_carbon_estimate",
-        description="Queries the Azure Consumption API to get real cloud spending for "
+        description="Queries the Azure Cost Management API to get real cloud spending for "
                     "the current month and estimates the carbon footprint of that cloud "
                     "usage. Call this when the user asks about Azure cloud costs, cloud "
                     "carbon footprint, or cloud energy usage."
     )
-    def get_azure_carbon_estimate(self) -> Annotated[str, "Azure cloud carbon audit report"]:
-        """Calls the live Azure Consumption API and converts spend to a carbon estimate."""
+    async def get_azure_carbon_estimate(self) -> Annotated[str, "Azure cloud carbon audit report"]:
+        """Calls the live Azure Cost Management API and converts spend to a carbon estimate."""
         subscription_id = os.getenv("AZURE_SUBSCRIPTION_ID")
 
         if not subscription_id:
             return "AZURE_SUBSCRIPTION_ID not set in .env file."
 
-        try:
-            from azure.identity import DefaultAzureCredential
-            from azure.mgmt.consumption import ConsumptionManagementClient
+        now = datetime.now(timezone.utc)
+        billing_period = now.strftime("%Y-%m")
 
-            credential = DefaultAzureCredential()
-            client = ConsumptionManagementClient(credential, subscription_id)
+        cache_key = (subscription_id, billing_period)
+        cached = _azure_cache.get(cache_key)
+        if cached and time.monotonic() - cached[0] < _AZURE_CACHE_TTL_SECONDS:
+            return cached[1]
+
+        try:
+            from azure.mgmt.costmanagement.aio import CostManagementClient
+            from azure.mgmt.costmanagement.models import (
+                QueryAggregation,
+                QueryDataset,
+                QueryDefinition,
+            )
 
-            now = datetime.now(timezone.utc)
-            billing_period = now.strftime("%Y-%m")
             scope = f"/subscriptions/{subscription_id}"
-            total_cost_usd = 0.0
-            currency = "USD"
-            item_count = 0
 
-            usage = client.usage_details.list(
-                scope=scope,
-                filter=f"properties/usageStart ge '{now.strftime('%Y-%m-01')}'"
+            # Let the service sum this month's cost: one aggregated row comes back
+            # instead of every usage line item being downloaded and summed here.
+            query = QueryDefinition(
+                type="ActualCost",
+                timeframe="MonthToDate",
+                dataset=QueryDataset(
+                    aggregation={"totalCost": QueryAggregation(name="Cost", function="Sum")},
+                ),
             )
-            for item in usage:
-                if hasattr(item, 'cost_in_billing_currency'):
-                    total_cost_usd += item.cost_in_billing_currency or 0
-                if hasattr(item, 'billing_currency'):
-                    currency = item.billing_currency or currency
-                item_count += 1
-
-            # Azure carbon intensity: 0.297 kg CO2/kWh (Microsoft 2023 Sustainability Report)
-            # Avg Azure compute cost: ~$0.10/kWh (estimate for general workloads)
+
+            await _wait_for_credential_warmup()
+            client = CostManagementClient(_get_azure_credential())
+            async with client:
+                result = await _query_cost_with_backoff(client, scope, query)
+
+            # Rows are [totalCost, Currency]; there is one row per billing currency
+            columns = [column.name for column in result.columns]
+            cost_index = columns.index("totalCost")
+            currency_index = columns.index("Currency") if "Currency" in columns else None
+            rows = result.rows or []
+            total_cost_usd = sum(row[cost_index] or 0 for row in rows)
+            currency = rows[-1][currency_index] if rows and currency_index is not None else "USD"
+
+            # Spend → energy → carbon, using the shared Azure cost and intensity proxies
             if total_cost_usd > 0:
-                estimated_kwh = total_cost_usd / 0.10
-                estimated_carbon_kg = estimated_kwh * 0.297
-                return (
-                    f"Azure Cloud Audit ({billing_period}):\n"
-                    f"- Usage Items: {item_count}\n"
-                    f"- Total Spend: ${total_cost_usd:.4f} {currency}\n"
-                    f"- Estimated Energy: {estimated_kwh:.4f} kWh\n"
-                    f"- Carbon Footprint: {estimated_carbon_kg:.6f} kg CO2\n"
-                    f"- Source: Azure Consumption API (live data)"
-                )
+                estimated_kwh = total_cost_usd / AZURE_USD_PER_KWH
+                estimated_carbon_kg = estimated_kwh * AZURE_KG_CO2_PER_KWH
+                report = _AZURE_REPORT({
+                    "period": billing_period,
+                    "cost": total_cost_usd,
+                    "currency": currency,
+                    "kwh": estimated_kwh,
+                    "carbon": estimated_carbon_kg,
+                })
             else:
-                return (
-                    f"Azure Cloud Audit ({billing_period}):\n"
-                    f"- Usage Items Found: {item_count}\n"
-                    f"- Total Spend: $0.00 (no billable usage this month)\n"
-                    f"- Carbon Footprint: 0.000000 kg CO2\n"
-                    f"- Source: Azure Consumption API (live data)"
-                )
+                report = _AZURE_EMPTY_REPORT({"period": billing_period})
 
         except Exception as e:
             return f"Azure query failed: {str(e)}"
 
+        _azure_cache[cache_key] = (time.monotonic(), report)
+        return report
+
     @kernel_function(
         name="audit_code",
         description="Audits a snippet of Python code for energy efficiency and returns "
@@ -195,19 +552,32 @@ class GreenSentryPlugin:
         Uses AZURE_OPENAI_FT_DEPLOYMENT if set (the fine-tuned model).
         Falls back to AZURE_OPENAI_DEPLOYMENT (base gpt-4o-mini) automatically.
         """
-        # Use the fine-tuned model if available, otherwise fall back to base model
-        ft_deployment = os.getenv("AZURE_OPENAI_FT_DEPLOYMENT")
-        deployment = ft_deployment or os.getenv("AZURE_OPENAI_DEPLOYMENT", "gpt-4o-mini")
-        model_label = "fine-tuned auditor" if ft_deployment else "base model (fine-tuning pending)"
-
-        client = AsyncAzureOpenAI(
-            azure_endpoint=os.getenv("AZURE_OPENAI_ENDPOINT"),
-            api_key=os.getenv("AZURE_OPENAI_API_KEY"),
-            api_version="2024-08-01-preview",
-        )
+        # The agent needs the whole audit as one tool result, so collect the stream
+        return "".join([token async for token in self.audit_code_stream(code)])
+
+    async def audit_code_stream(self, code: str) -> AsyncIterator[str]:
+        """Streams a green code audit token by token as the model generates it.
+
+        Yields the report header first, then each content delta, so the CLI can
+        print the refactor as it arrives instead of waiting for the full reply.
+        """
+        deployment, model_label = _auditor_deployment()
+
+        cache_key = _audit_cache_key(deployment, code)
+        cached = _get_cached_audit(cache_key)
+        if cached is not None:
+            yield f"Green Code Audit [{model_label}, cached]:\n\n{cached}"
+            return
+
+        known = _match_known_example(code)
+        if known is not None:
+            yield f"Green Code Audit [local-cache]:\n\n{known}"
+            return
+
+        client = self._get_openai_client()
 
         try:
-            response = await client.chat.completions.create(
+            stream = await client.chat.completions.create(
                 model=deployment,
                 messages=[
                     {"role": "system", "content": _AUDITOR_SYSTEM_PROMPT},
@@ -215,12 +585,106 @@ class GreenSentryPlugin:
                 ],
                 temperature=0.2,
                 max_tokens=400,
+                user=_AUDITOR_CACHE_USER,
+                stream=True,
+            )
+        except Exception as e:
+            yield f"Code audit failed: {str(e)}"
+            return
+
+        yield f"Green Code Audit [{model_label}]:\n\n"
+
+        parts = []
+        try:
+            async for chunk in stream:
+                # Azure sends content-filter chunks with no choices; skip them
+                if not chunk.choices:
+                    continue
+                token = chunk.choices[0].delta.content
+                if token:
+                    parts.append(token)
+                    yield token
+        except Exception as e:
+            yield f"\n\nCode audit failed: {str(e)}"
+            return
+
+        _store_audit(cache_key, "".join(parts))
+
+    @kernel_function(
+        name="audit_code_batch",
+        description="Audits several Python code snippets for energy efficiency in one "
+                    "request and returns a greener refactor with an explanation for each. "
+                    "Call this instead of audit_code when the user shares more than one "
+                    "function or snippet at once."
+    )
+    async def audit_code_batch(
+        self,
+        snippets: Annotated[list[str], "The Python code snippets to audit, one entry per snippet"]
+    ) -> Annotated[str, "Green code audits with a refactor and explanation per snippet"]:
+        """Audits many snippets with one model call per group instead of one call each.
+
+        Cached snippets are answered locally; the misses are sent numbered in one
+        user message per group of _BATCH_MAX_SNIPPETS, so the system prompt is sent
+        once per group and each reply stays within the model's output limit.
+        """
+        if not snippets:
+            return "No code snippets provided."
+
+        deployment, model_label = _auditor_deployment()
+        keys = [_audit_cache_key(deployment, code) for code in snippets]
+        results = [
+            _get_cached_audit(key) or _match_known_example(code)
+            for key, code in zip(keys, snippets)
+        ]
+        pending = [i for i, result in enumerate(results) if result is None]
+        groups = [
+            pending[start:start + _BATCH_MAX_SNIPPETS]
+            for start in range(0, len(pending), _BATCH_MAX_SNIPPETS)
+        ]
+
+        try:
+            replies = await asyncio.gather(
+                *(self._request_batch_audit(deployment, [snippets[i] for i in group])
+                  for group in groups)
             )
-            result = response.choices[0].message.content
-            return f"Green Code Audit [{model_label}]:\n\n{result}"
         except Exception as e:
             return f"Code audit failed: {str(e)}"
 
+        for group, content in zip(groups, replies):
+            blocks = [b.strip() for b in re.split(r"^\s*---\s*$", content, flags=re.MULTILINE)]
+            blocks = [b for b in blocks if b]
+            if len(blocks) != len(group):
+                # The model didn't keep one block per snippet; show the reply unsplit
+                results[group[0]] = content
+                for i in group[1:]:
+                    results[i] = f"Included in the audit for snippet {group[0] + 1} above."
+                continue
+            for i, block in zip(group, blocks):
+                results[i] = block
+                _store_audit(keys[i], block)
+
+        audits = "\n\n".join(f"Snippet {n}:\n{r}" for n, r in enumerate(results, start=1))
+        return f"Green Code Audit [{model_label}]:\n\n{audits}"
+
+    async def _request_batch_audit(self, deployment: str, codes: list[str]) -> str:
+        """Sends one numbered multi-snippet audit request and returns the raw reply."""
+        numbered = "\n\n".join(f"Snippet {n}:\n{code}" for n, code in enumerate(codes, start=1))
+        response = await self._get_openai_client().chat.completions.create(
+            model=deployment,
+            messages=[
+                {"role": "system", "content": _AUDITOR_SYSTEM_PROMPT},
+                {"role": "user", "content": (
+                    "Audit each snippet below for energy efficiency. Respond with one "
+                    "REFACTOR/WHY block per snippet, in order, separated by a line "
+                    f"containing only '---'.\n\n{numbered}"
+                )},
+            ],
+            temperature=0.2,
+            max_tokens=400 * len(codes),
+            user=_AUDITOR_CACHE_USER,
+        )
+        return response.choices[0].message.content
+
 
 # =============================================================================
 # SECTION 2: Build the Kernel and Agent
@@ -229,8 +693,14 @@ class GreenSentryPlugin:
 # (which model to use) and the plugins (which tools are available).
 # The Agent wraps the Kernel and adds a persona via the instructions prompt.
 
-def build_kernel() -> Kernel:
-    """Creates a Semantic Kernel with Azure OpenAI and the GreenSentry plugin."""
+def build_kernel() -> tuple[Kernel, GreenSentryPlugin]:
+    """Creates a Semantic Kernel with Azure OpenAI and the GreenSentry plugin.
+
+    Also returns the registered plugin so the CLI shares its client and caches.
+    """
+    # Imported here so the connector stack only loads when the agent starts
+    from semantic_kernel.connectors.ai.open_ai import AzureChatCompletion
+
     load_dotenv()
 
     azure_endpoint = os.getenv("AZURE_OPENAI_ENDPOINT")
@@ -254,9 +724,16 @@ def build_kernel() -> Kernel:
     )
 
     # Register the carbon auditing tools so the agent can call them
-    kernel.add_plugin(GreenSentryPlugin(), plugin_name="GreenSentry")
+    plugin = GreenSentryPlugin(openai_client=create_openai_client())
+    kernel.add_plugin(plugin, plugin_name="GreenSentry")
 
-    return kernel
+    # Keep a warm CPU/RAM reading so get_green_metrics answers instantly
+    start_metrics_sampler()
+
+    # Fetch the Azure token now rather than on the first cloud question
+    start_azure_credential_warmup()
+
+    return kernel, plugin
 
 
 # =============================================================================
@@ -267,25 +744,32 @@ def build_kernel() -> Kernel:
 # so the agent remembers what was said earlier in the same session.
 
 async def main():
+    import aioconsole
+    from semantic_kernel.agents import ChatCompletionAgent
+
     print("🌿 Initialising GreenSentry Agent...")
 
     try:
-        kernel = build_kernel()
+        kernel, plugin = build_kernel()  # plugin is also used directly by /audit
     except ValueError as e:
         print(f"ERROR: {e}")
         return
 
+    # Semantic Kernel awaits the tool calls of one model reply together; since
+    # every GreenSentry tool is a coroutine, a compound question costs max() not sum().
     agent = ChatCompletionAgent(
         kernel=kernel,
         name="GreenSentry",
         instructions="""You are GreenSentry, an expert Sustainability SRE (Site Reliability Engineer).
 Your mission: help engineers understand and reduce the carbon footprint of their systems.
 
-You have three tools. You MUST call a tool before every response — never answer from memory alone:
+You have four tools. You MUST call a tool before every response — never answer from memory alone:
 1. get_green_metrics — measures local CPU/RAM and estimates power draw + carbon footprint
 2. get_azure_carbon_estimate — queries real Azure cloud spending and estimates cloud carbon impact
 3. audit_code — the ONLY way to audit code. If the user shares ANY code snippet, you MUST call
    audit_code(code=<the snippet>) FIRST. Do not write a refactor yourself — call the tool.
+4. audit_code_batch — when the user shares SEVERAL snippets, call audit_code_batch(snippets=[...])
+   once with all of them instead of calling audit_code repeatedly.
 
 Rules:
 - ALWAYS call the relevant tool first. Never answer sustainability or code questions without a tool call.
@@ -300,13 +784,14 @@ Rules:
     print("     /audit <code>  — directly audit a code snippet for energy efficiency")
     print("     quit           — exit\n")
 
-    plugin = GreenSentryPlugin()  # Direct access for /audit command
     thread = None  # Conversation history — None means a fresh session
 
     while True:
+        # ainput keeps the event loop running while the user types, so background
+        # work (CPU sampler, cache refreshes) carries on during think-time.
         try:
-            user_input = input("You: ").strip()
-        except (KeyboardInterrupt, EOFError):
+            user_input = (await aioconsole.ainput("You: ")).strip()
+        except (KeyboardInterrupt, EOFError, asyncio.CancelledError):
             print("\nGoodbye!")
             break
 
@@ -321,8 +806,9 @@ Rules:
         if user_input.startswith("/audit "):
             code = user_input[len("/audit "):]
             print("GreenSentry: ", end="", flush=True)
-            result = await plugin.audit_code(code)
-            print(result + "\n")
+            async for token in plugin.audit_code_stream(code):
+                print(token, end="", flush=True)
+            print("\n")
             continue
 
         # For all other questions, let the agent decide which tool(s) to call.
@@ -336,6 +822,9 @@ Rules:
     # Release the conversation thread when the session ends
     if thread:
         await thread.delete()
+    await plugin.aclose()
+    await stop_metrics_sampler()
+    await close_azure_credential()
 
 
 if __name__ == "__main__":
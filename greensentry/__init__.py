@@ -0,0 +1 @@
+"""Shared building blocks for the GreenSentry agent and MCP server."""
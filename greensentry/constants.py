@@ -0,0 +1,25 @@
+"""
+Carbon estimation constants shared by the GreenSentry agent and MCP server.
+Keeping them in one place stops the two tool implementations drifting apart.
+"""
+
+# =============================================================================
+# Local hardware
+# =============================================================================
+# Mac power draw: 5W idle, scales with CPU load
+# Source: https://eclecticlight.co/2024/02/23/apple-silicon-2-power-and-thermal-glory/
+IDLE_WATTS = 5.0
+WATTS_PER_CPU_PERCENT = 0.55
+
+# Carbon intensity: 0.475g CO2 per Wh (average US grid), pre-divided by 1000
+# so the report value is a single multiply: watts * LOCAL_CO2_G_PER_WATT
+LOCAL_CO2_G_PER_WATT = 0.000475
+
+# =============================================================================
+# Azure cloud
+# =============================================================================
+# Azure carbon intensity: 0.297 kg CO2/kWh (Microsoft 2023 Sustainability Report)
+AZURE_KG_CO2_PER_KWH = 0.297
+
+# Avg Azure compute cost: ~$0.10/kWh (estimate for general workloads)
+AZURE_USD_PER_KWH = 0.10
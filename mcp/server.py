@@ -1,8 +1,20 @@
 from mcp.server.fastmcp import FastMCP
+import asyncio
 import psutil
 import os
+import sys
 from dotenv import load_dotenv
 
+# Make the shared greensentry package importable when run as a script
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from greensentry.constants import (
+    AZURE_KG_CO2_PER_KWH,
+    AZURE_USD_PER_KWH,
+    IDLE_WATTS,
+    LOCAL_CO2_G_PER_WATT,
+    WATTS_PER_CPU_PERCENT,
+)
+
 # Load secrets from .env file into the environment
 load_dotenv()
 
@@ -10,17 +22,18 @@ load_dotenv()
 mcp = FastMCP("GreenSentry-Auditor")
 
 @mcp.tool()
-def get_green_metrics() -> str:
+async def get_green_metrics() -> str:
     """Calculates estimated carbon impact based on current Mac hardware load."""
-    cpu = psutil.cpu_percent(interval=1)
+    # The blocking 1s sample runs in a worker thread so the server loop stays free
+    cpu = await asyncio.to_thread(psutil.cpu_percent, 1)
     ram = psutil.virtual_memory().percent
 
     # 🧪 The Science:
-    # Average Mac power draw is roughly 5W (idle) to 60W (load). Source: https://eclecticlight.co/2024/02/23/apple-silicon-2-power-and-thermal-glory/
-    # Carbon Intensity (avg): 0.475g CO2 per kWh
+    # Average Mac power draw is roughly 5W (idle) to 60W (load).
+    # Power profile and grid intensity (with sources) live in greensentry/constants.py
 
-    est_watts = 5 + (cpu * 0.55)
-    carbon_impact = (est_watts / 1000) * 0.475
+    est_watts = IDLE_WATTS + cpu * WATTS_PER_CPU_PERCENT
+    carbon_impact = est_watts * LOCAL_CO2_G_PER_WATT
 
     return (f"🌱 GreenSentry Local Audit Report:\n"
             f"- CPU Usage: {cpu}%\n"
@@ -66,13 +79,11 @@ def get_azure_carbon_estimate() -> str:
                 currency = item.billing_currency or currency
             item_count += 1
 
-        # 🧪 Carbon estimation:
-        # Azure's global average carbon intensity: ~0.297 kg CO2 per kWh (2023 Sustainability Report)
-        # Average Azure cost per kWh of compute: ~$0.10 (rough estimate for general workloads)
+        # 🧪 Carbon estimation (constants in greensentry/constants.py):
         # Formula: cost_usd / cost_per_kwh * carbon_intensity_kg
         if total_cost_usd > 0:
-            estimated_kwh = total_cost_usd / 0.10
-            estimated_carbon_kg = estimated_kwh * 0.297
+            estimated_kwh = total_cost_usd / AZURE_USD_PER_KWH
+            estimated_carbon_kg = estimated_kwh * AZURE_KG_CO2_PER_KWH
             return (f"☁️ GreenSentry Azure Audit Report ({billing_period}):\n"
                     f"- Subscription: AIDevDaysHackathon\n"
                     f"- Usage Items Found: {item_count}\n"
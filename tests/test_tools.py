@@ -8,42 +8,79 @@ Run with:  pytest tests/test_tools.py -v
 """
 
 import asyncio
+import logging
 import os
+import time
+from types import SimpleNamespace
 from unittest.mock import AsyncMock, MagicMock, patch
 
 import pytest
 import sys
 
 sys.path.insert(0, os.path.dirname(os.path.dirname(__file__)))
+from agents import green_agent
 from agents.green_agent import GreenSentryPlugin
 
 
+@pytest.fixture(autouse=True)
+def clear_caches():
+    """Each test starts with empty result caches."""
+    green_agent._azure_cache.clear()
+    green_agent._audit_cache.clear()
+    green_agent._credential = None
+    yield
+    green_agent._azure_cache.clear()
+    green_agent._audit_cache.clear()
+    green_agent._credential = None
+
+
 # =============================================================================
 # Tool 1: get_green_metrics (local hardware — no mocking needed)
 # =============================================================================
 
-def test_green_metrics_returns_string():
+@pytest.mark.asyncio
+async def test_green_metrics_returns_string():
     """get_green_metrics should return a non-empty string."""
     plugin = GreenSentryPlugin()
-    result = plugin.get_green_metrics()
+    result = await plugin.get_green_metrics()
     assert isinstance(result, str)
     assert len(result) > 0
 
 
-def test_green_metrics_contains_expected_fields():
+@pytest.mark.asyncio
+async def test_green_metrics_does_not_block_event_loop():
+    """Other coroutines should keep running while the CPU sample is taken."""
+    plugin = GreenSentryPlugin()
+    finished = []
+
+    async def metrics():
+        await plugin.get_green_metrics()
+        finished.append("metrics")
+
+    async def ticker():
+        await asyncio.sleep(0.1)
+        finished.append("ticker")
+
+    await asyncio.gather(metrics(), ticker())
+    assert finished == ["ticker", "metrics"]
+
+
+@pytest.mark.asyncio
+async def test_green_metrics_contains_expected_fields():
     """Output should contain all four key fields."""
     plugin = GreenSentryPlugin()
-    result = plugin.get_green_metrics()
+    result = await plugin.get_green_metrics()
     assert "CPU Usage" in result
     assert "RAM Usage" in result
     assert "Power Draw" in result
     assert "Carbon Footprint" in result
 
 
-def test_green_metrics_carbon_is_positive():
+@pytest.mark.asyncio
+async def test_green_metrics_carbon_is_positive():
     """Carbon footprint should always be a positive number."""
     plugin = GreenSentryPlugin()
-    result = plugin.get_green_metrics()
+    result = await plugin.get_green_metrics()
     # Extract the carbon value from "Carbon Footprint: 0.00123g CO2/hr"
     for line in result.splitlines():
         if "Carbon Footprint" in line:
@@ -52,45 +89,248 @@ def test_green_metrics_carbon_is_positive():
             break
 
 
+@pytest.mark.asyncio
+async def test_green_metrics_reads_background_sample():
+    """A fresh background sample should be reported without taking a new one."""
+    plugin = GreenSentryPlugin()
+    green_agent._latest_sample = (50.0, 40.0, time.monotonic())
+    try:
+        with patch("agents.green_agent.psutil.cpu_percent") as cpu_percent:
+            result = await plugin.get_green_metrics()
+    finally:
+        green_agent._latest_sample = None
+
+    cpu_percent.assert_not_called()
+    assert "CPU Usage: 50.0%" in result
+    assert "RAM Usage: 40.0%" in result
+
+
+@pytest.mark.asyncio
+async def test_metrics_sampler_refreshes_latest_sample():
+    """The background sampler should publish a reading every interval."""
+    green_agent.start_metrics_sampler()
+    try:
+        await asyncio.sleep(green_agent._SAMPLE_INTERVAL_SECONDS + 0.2)
+        assert green_agent._latest_sample is not None
+    finally:
+        await green_agent.stop_metrics_sampler()
+    assert green_agent._latest_sample is None
+
+
 # =============================================================================
 # Tool 2: get_azure_carbon_estimate (mocked — no Azure credentials needed)
 # =============================================================================
 
-def test_azure_estimate_missing_subscription():
+@pytest.mark.asyncio
+async def test_azure_estimate_missing_subscription():
     """Should return a clear error message when subscription ID is missing."""
     plugin = GreenSentryPlugin()
     with patch.dict(os.environ, {"AZURE_SUBSCRIPTION_ID": ""}):
-        result = plugin.get_azure_carbon_estimate()
+        result = await plugin.get_azure_carbon_estimate()
     assert "AZURE_SUBSCRIPTION_ID" in result
 
 
-def test_azure_estimate_returns_string_on_auth_failure():
+@pytest.mark.asyncio
+async def test_azure_estimate_returns_string_on_auth_failure():
     """Should return an error string (not raise) if Azure auth fails."""
     plugin = GreenSentryPlugin()
     with patch.dict(os.environ, {"AZURE_SUBSCRIPTION_ID": "fake-sub-id"}):
-        with patch("azure.identity.DefaultAzureCredential", side_effect=Exception("no credentials")):
-            result = plugin.get_azure_carbon_estimate()
+        with patch("azure.identity.aio.DefaultAzureCredential", side_effect=Exception("no credentials")):
+            result = await plugin.get_azure_carbon_estimate()
     assert isinstance(result, str)
     assert "failed" in result.lower() or "error" in result.lower() or "Azure query failed" in result
 
 
+def _mock_cost_client(rows):
+    """Builds a CostManagementClient whose query returns the given [cost, currency] rows."""
+    result = SimpleNamespace(
+        columns=[SimpleNamespace(name="totalCost"), SimpleNamespace(name="Currency")],
+        rows=rows,
+    )
+    client = MagicMock()
+    client.query.usage = AsyncMock(return_value=result)
+    return client
+
+
+@pytest.mark.asyncio
+async def test_azure_estimate_reads_aggregated_cost():
+    """Spend should come from the server-side aggregated cost row."""
+    plugin = GreenSentryPlugin()
+    mock_client = _mock_cost_client([[4.0, "EUR"]])
+
+    with patch.dict(os.environ, {"AZURE_SUBSCRIPTION_ID": "fake-sub-id"}):
+        with patch("azure.identity.aio.DefaultAzureCredential", return_value=MagicMock()):
+            with patch("azure.mgmt.costmanagement.aio.CostManagementClient", return_value=mock_client):
+                result = await plugin.get_azure_carbon_estimate()
+
+    assert "Total Spend: $4.0000 EUR" in result
+    assert mock_client.query.usage.await_args.kwargs["scope"] == "/subscriptions/fake-sub-id"
+
+
+@pytest.mark.asyncio
+async def test_azure_estimate_retries_throttled_query():
+    """A 429 from Cost Management should be retried, not reported as a failure."""
+    from azure.core.exceptions import HttpResponseError
+
+    plugin = GreenSentryPlugin()
+    throttled = HttpResponseError(message="Too many requests")
+    throttled.status_code = 429
+
+    mock_client = _mock_cost_client([[4.0, "EUR"]])
+    mock_client.query.usage.side_effect = [throttled, mock_client.query.usage.return_value]
+
+    with patch.dict(os.environ, {"AZURE_SUBSCRIPTION_ID": "fake-sub-id"}):
+        with patch("azure.identity.aio.DefaultAzureCredential", return_value=MagicMock()):
+            with patch("azure.mgmt.costmanagement.aio.CostManagementClient", return_value=mock_client):
+                with patch.object(green_agent, "_AZURE_BACKOFF_BASE_SECONDS", 0.0):
+                    result = await plugin.get_azure_carbon_estimate()
+
+    assert mock_client.query.usage.await_count == 2
+    assert "Total Spend: $4.0000 EUR" in result
+
+
+@pytest.mark.asyncio
+async def test_azure_estimate_reuses_cached_report():
+    """A repeat query for the same billing period should not hit the API again."""
+    plugin = GreenSentryPlugin()
+    mock_client = _mock_cost_client([[1.0, "USD"]])
+
+    with patch.dict(os.environ, {"AZURE_SUBSCRIPTION_ID": "fake-sub-id"}):
+        with patch("azure.identity.aio.DefaultAzureCredential", return_value=MagicMock()):
+            with patch("azure.mgmt.costmanagement.aio.CostManagementClient",
+                       return_value=mock_client):
+                first = await plugin.get_azure_carbon_estimate()
+                second = await plugin.get_azure_carbon_estimate()
+
+    assert first == second
+    assert mock_client.query.usage.await_count == 1
+
+
+@pytest.mark.asyncio
+async def test_azure_credential_is_shared_across_queries():
+    """The credential should be built once and reused, not re-probed per call."""
+    plugin = GreenSentryPlugin()
+    mock_client = _mock_cost_client([[1.0, "USD"]])
+
+    with patch.dict(os.environ, {"AZURE_SUBSCRIPTION_ID": "fake-sub-id"}):
+        with patch("azure.identity.aio.DefaultAzureCredential",
+                   return_value=MagicMock()) as credential_cls:
+            with patch("azure.mgmt.costmanagement.aio.CostManagementClient",
+                       return_value=mock_client):
+                await plugin.get_azure_carbon_estimate()
+                green_agent._azure_cache.clear()
+                await plugin.get_azure_carbon_estimate()
+
+    assert credential_cls.call_count == 1
+    assert mock_client.query.usage.await_count == 2
+
+
+@pytest.mark.asyncio
+async def test_azure_credential_warmup_fetches_token_once():
+    """Warm-up should fetch a management token on the credential later queries reuse."""
+    plugin = GreenSentryPlugin()
+    credential = MagicMock()
+    credential.get_token = AsyncMock()
+    credential.close = AsyncMock()
+    mock_client = _mock_cost_client([[1.0, "USD"]])
+
+    with patch.dict(os.environ, {"AZURE_SUBSCRIPTION_ID": "fake-sub-id"}):
+        with patch("azure.identity.aio.DefaultAzureCredential",
+                   return_value=credential) as credential_cls:
+            with patch("azure.mgmt.costmanagement.aio.CostManagementClient",
+                       return_value=mock_client) as client_cls:
+                green_agent.start_azure_credential_warmup()
+                await green_agent._credential_warmup_task
+                await plugin.get_azure_carbon_estimate()
+                await green_agent.close_azure_credential()
+
+    credential.get_token.assert_awaited_once_with("https://management.azure.com/.default")
+    assert credential_cls.call_count == 1
+    assert client_cls.call_args.args[0] is credential
+    credential.close.assert_awaited_once()
+
+
+@pytest.mark.asyncio
+async def test_azure_query_waits_for_pending_warmup():
+    """A query issued mid warm-up should wait for it instead of probing in parallel."""
+    plugin = GreenSentryPlugin()
+    order = []
+
+    async def slow_get_token(scope):
+        await asyncio.sleep(0.1)
+        order.append("warm-up")
+
+    credential = MagicMock()
+    credential.get_token = slow_get_token
+    credential.close = AsyncMock()
+    mock_client = _mock_cost_client([[1.0, "USD"]])
+
+    async def query_usage(**kwargs):
+        order.append("query")
+        return mock_client.query.usage.return_value
+
+    mock_client.query.usage.side_effect = query_usage
+
+    with patch.dict(os.environ, {"AZURE_SUBSCRIPTION_ID": "fake-sub-id"}):
+        with patch("azure.identity.aio.DefaultAzureCredential", return_value=credential):
+            with patch("azure.mgmt.costmanagement.aio.CostManagementClient", return_value=mock_client):
+                green_agent.start_azure_credential_warmup()
+                await plugin.get_azure_carbon_estimate()
+                await green_agent.close_azure_credential()
+
+    assert order == ["warm-up", "query"]
+
+
+def test_azure_credential_warmup_mutes_identity_warnings():
+    """Warm-up should mute azure.identity warnings only while it runs."""
+    identity_logger = logging.getLogger("azure.identity")
+    identity_logger.setLevel(logging.INFO)
+    levels_during_probe = []
+
+    async def failing_get_token(scope):
+        levels_during_probe.append(identity_logger.level)
+        raise Exception("no credentials")
+
+    credential = MagicMock()
+    credential.get_token = failing_get_token
+
+    try:
+        with patch("azure.identity.aio.DefaultAzureCredential", return_value=credential):
+            asyncio.run(green_agent._warm_azure_credential())
+        assert levels_during_probe == [logging.ERROR]
+        assert identity_logger.level == logging.INFO
+    finally:
+        identity_logger.setLevel(logging.NOTSET)
+
+
 # =============================================================================
 # Tool 3: audit_code (mocked — no Azure OpenAI call made)
 # =============================================================================
 
+def _mock_stream(text):
+    """Builds a streamed chat completion that yields text in two chunks."""
+    chunks = []
+    for part in (text[:len(text) // 2], text[len(text) // 2:]):
+        chunk = MagicMock()
+        chunk.choices[0].delta.content = part
+        chunks.append(chunk)
+    stream = MagicMock()
+    stream.__aiter__.return_value = chunks
+    return stream
+
+
 @pytest.mark.asyncio
 async def test_audit_code_returns_refactor_format():
     """audit_code output should contain REFACTOR and WHY."""
     plugin = GreenSentryPlugin()
 
-    mock_response = MagicMock()
-    mock_response.choices[0].message.content = (
+    mock_stream = _mock_stream(
         "REFACTOR: import time\nwhile True:\n    check()\n    time.sleep(60)\n"
         "WHY: Adding a sleep timer prevents 100% CPU usage during idle loops."
     )
 
     mock_client = AsyncMock()
-    mock_client.chat.completions.create = AsyncMock(return_value=mock_response)
+    mock_client.chat.completions.create = AsyncMock(return_value=mock_stream)
 
     with patch("agents.green_agent.AsyncAzureOpenAI", return_value=mock_client):
         result = await plugin.audit_code("while True: check()")
@@ -104,11 +344,10 @@ async def test_audit_code_labels_fine_tuned_model():
     """Label should say 'fine-tuned auditor' when FT_DEPLOYMENT is set."""
     plugin = GreenSentryPlugin()
 
-    mock_response = MagicMock()
-    mock_response.choices[0].message.content = "REFACTOR: fixed\nWHY: saves energy."
+    mock_stream = _mock_stream("REFACTOR: fixed\nWHY: saves energy.")
 
     mock_client = AsyncMock()
-    mock_client.chat.completions.create = AsyncMock(return_value=mock_response)
+    mock_client.chat.completions.create = AsyncMock(return_value=mock_stream)
 
     with patch.dict(os.environ, {"AZURE_OPENAI_FT_DEPLOYMENT": "gpt-4o-mini-greensentry-ft"}):
         with patch("agents.green_agent.AsyncAzureOpenAI", return_value=mock_client):
@@ -122,11 +361,10 @@ async def test_audit_code_labels_base_model_fallback():
     """Label should say 'base model' when FT_DEPLOYMENT is not set."""
     plugin = GreenSentryPlugin()
 
-    mock_response = MagicMock()
-    mock_response.choices[0].message.content = "REFACTOR: fixed\nWHY: saves energy."
+    mock_stream = _mock_stream("REFACTOR: fixed\nWHY: saves energy.")
 
     mock_client = AsyncMock()
-    mock_client.chat.completions.create = AsyncMock(return_value=mock_response)
+    mock_client.chat.completions.create = AsyncMock(return_value=mock_stream)
 
     with patch.dict(os.environ, {"AZURE_OPENAI_FT_DEPLOYMENT": ""}):
         with patch("agents.green_agent.AsyncAzureOpenAI", return_value=mock_client):
@@ -148,3 +386,165 @@ async def test_audit_code_handles_api_failure_gracefully():
 
     assert isinstance(result, str)
     assert "failed" in result.lower()
+
+
+@pytest.mark.asyncio
+async def test_audit_code_reuses_cached_result():
+    """Re-auditing the same snippet (modulo indentation) should skip the API call."""
+    plugin = GreenSentryPlugin()
+
+    mock_stream = _mock_stream("REFACTOR: fixed\nWHY: saves energy.")
+
+    mock_client = AsyncMock()
+    mock_client.chat.completions.create = AsyncMock(return_value=mock_stream)
+
+    with patch("agents.green_agent.AsyncAzureOpenAI", return_value=mock_client):
+        first = await plugin.audit_code("for x in data: process(x)")
+        second = await plugin.audit_code("    for x in data: process(x)\n")
+
+    assert mock_client.chat.completions.create.await_count == 1
+    assert "cached" in second
+    assert "REFACTOR: fixed" in second
+    assert "cached" not in first
+
+
+@pytest.mark.asyncio
+async def test_audit_code_reuses_injected_client():
+    """An injected client should serve every audit; no new client is built."""
+    mock_stream = _mock_stream("REFACTOR: fixed\nWHY: saves energy.")
+
+    mock_client = AsyncMock()
+    mock_client.chat.completions.create = AsyncMock(return_value=mock_stream)
+    plugin = GreenSentryPlugin(openai_client=mock_client)
+
+    with patch("agents.green_agent.AsyncAzureOpenAI") as client_cls:
+        await plugin.audit_code("while True: poll()")
+        await plugin.audit_code("data = [i for i in range(10)]")
+
+    client_cls.assert_not_called()
+    assert mock_client.chat.completions.create.await_count == 2
+
+
+@pytest.mark.asyncio
+async def test_audit_code_batch_uses_single_call():
+    """Several snippets should be audited with one API call and split per snippet."""
+    plugin = GreenSentryPlugin()
+
+    mock_response = MagicMock()
+    mock_response.choices[0].message.content = (
+        "REFACTOR: first fix\nWHY: saves CPU.\n---\nREFACTOR: second fix\nWHY: saves RAM."
+    )
+
+    mock_client = AsyncMock()
+    mock_client.chat.completions.create = AsyncMock(return_value=mock_response)
+
+    with patch("agents.green_agent.AsyncAzureOpenAI", return_value=mock_client):
+        result = await plugin.audit_code_batch(["while True: poll()", "data = list(range(10**6))"])
+        single = await plugin.audit_code("data = list(range(10**6))")
+
+    assert mock_client.chat.completions.create.await_count == 1
+    assert "Snippet 1:\nREFACTOR: first fix" in result
+    assert "Snippet 2:\nREFACTOR: second fix" in result
+    assert "cached" in single and "second fix" in single
+
+
+@pytest.mark.asyncio
+async def test_audit_code_batch_splits_large_pastes():
+    """Large batches should be split so no call asks for more than the per-call cap."""
+    reply = MagicMock()
+    reply.choices[0].message.content = "\n---\n".join(
+        f"REFACTOR: fix\nWHY: reason {n}." for n in range(green_agent._BATCH_MAX_SNIPPETS)
+    )
+    short_reply = MagicMock()
+    short_reply.choices[0].message.content = "REFACTOR: last fix\nWHY: last reason."
+
+    mock_client = AsyncMock()
+    mock_client.chat.completions.create = AsyncMock(side_effect=[reply, short_reply])
+    plugin = GreenSentryPlugin(openai_client=mock_client)
+
+    snippets = [f"value_{n} = compute({n})" for n in range(green_agent._BATCH_MAX_SNIPPETS + 1)]
+    result = await plugin.audit_code_batch(snippets)
+
+    calls = mock_client.chat.completions.create.await_args_list
+    assert len(calls) == 2
+    assert max(c.kwargs["max_tokens"] for c in calls) == 400 * green_agent._BATCH_MAX_SNIPPETS
+    assert f"Snippet {len(snippets)}:\nREFACTOR: last fix" in result
+
+
+@pytest.mark.asyncio
+async def test_audit_code_sends_cacheable_prompt_prefix():
+    """The system prompt should be long enough for prompt caching and sent with a stable user."""
+    plugin = GreenSentryPlugin()
+
+    mock_stream = _mock_stream("REFACTOR: fixed\nWHY: saves energy.")
+
+    mock_client = AsyncMock()
+    mock_client.chat.completions.create = AsyncMock(return_value=mock_stream)
+
+    with patch("agents.green_agent.AsyncAzureOpenAI", return_value=mock_client):
+        await plugin.audit_code("while True: poll()")
+
+    kwargs = mock_client.chat.completions.create.await_args.kwargs
+    # ~4 characters per token: comfortably above the 1024-token cache threshold
+    assert len(kwargs["messages"][0]["content"]) > 4 * 1024
+    assert kwargs["user"] == "greensentry-auditor-v1"
+
+
+@pytest.mark.asyncio
+async def test_audit_code_stream_yields_tokens_progressively():
+    """The streaming variant should yield the header and then each model chunk."""
+    plugin = GreenSentryPlugin()
+
+    mock_client = AsyncMock()
+    mock_client.chat.completions.create = AsyncMock(
+        return_value=_mock_stream("REFACTOR: fixed\nWHY: saves energy.")
+    )
+
+    with patch("agents.green_agent.AsyncAzureOpenAI", return_value=mock_client):
+        tokens = [t async for t in plugin.audit_code_stream("while True: poll()")]
+
+    assert tokens[0].startswith("Green Code Audit")
+    assert len(tokens) == 3
+    assert "".join(tokens[1:]) == "REFACTOR: fixed\nWHY: saves energy."
+    assert mock_client.chat.completions.create.await_args.kwargs["stream"] is True
+
+
+@pytest.mark.asyncio
+async def test_audit_code_answers_known_example_locally():
+    """A copy of a training example (modulo whitespace) should be answered without the model."""
+    mock_client = AsyncMock()
+    plugin = GreenSentryPlugin(openai_client=mock_client)
+
+    result = await plugin.audit_code("while True:\n    print('Checking updates...')")
+
+    mock_client.chat.completions.create.assert_not_called()
+    assert "local-cache" in result
+    assert "time.sleep(60)" in result
+
+
+@pytest.mark.asyncio
+async def test_audit_code_sends_near_miss_of_known_example_to_model():
+    """A snippet that differs from an example beyond whitespace must not get its canned answer."""
+    mock_client = AsyncMock()
+    mock_client.chat.completions.create = AsyncMock(
+        return_value=_mock_stream("REFACTOR: fixed\nWHY: saves energy.")
+    )
+    plugin = GreenSentryPlugin(openai_client=mock_client)
+
+    result = await plugin.audit_code("cursor.execute('SELECT * FROM global_orders')")
+
+    mock_client.chat.completions.create.assert_awaited_once()
+    assert "local-cache" not in result
+    assert "global_users" not in result
+
+
+@pytest.mark.asyncio
+async def test_plugin_aclose_closes_shared_client():
+    """aclose should release the auditor client the plugin was given."""
+    mock_client = AsyncMock()
+    plugin = GreenSentryPlugin(openai_client=mock_client)
+
+    await plugin.aclose()
+
+    mock_client.close.assert_awaited_once()
+